@@ -2,11 +2,16 @@
 
 # pylint ignores
 # pylint: disable=too-many-arguments
+# pylint: disable=too-many-instance-attributes
+# pylint: disable=too-many-locals
 
 # Import python standard libraries
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import ipaddress
-from math import ceil, log
 import re
+import string
+from types import MappingProxyType
 
 # Import custom libraries
 import boto3
@@ -21,222 +26,358 @@ from troposphere.ec2 import Tag, VPCGatewayAttachment
 
 TITLE_CLEANUP_RE = re.compile(r'[^a-zA-Z0-9]+')
 
+class TitleCleanupTable(dict):
+    """Translation table for str.translate keeping only the characters of
+    TITLE_CLEANUP_RE, deleting any other character on first lookup"""
+    def __init__(self):
+        super().__init__((ord(char), ord(char)) for char in
+                         string.ascii_letters + string.digits)
+
+    def __missing__(self, key):
+        value = self[key] = None
+        return value
+
+TITLE_CLEANUP_TABLE = TitleCleanupTable()
+
+@lru_cache(maxsize=None)
+def clean_title(title):
+    """Strip characters that are not valid in a CloudFormation title"""
+    return title.translate(TITLE_CLEANUP_TABLE)
+
+@lru_cache(maxsize=None)
+def stack_export(name):
+    """Returns the export name prefixed with the stack name, shared between
+    outputs exporting the same name"""
+    return Sub('${AWS::StackName}' + name)
+
+# Availability zones per (AWS profile or access key, region), shared across
+# VPC instances as the zones in a region rarely change
+AVAILABILITY_ZONES_CACHE = {}
+
+# Default cap on concurrent availability zone lookups
+AVAILABILITY_ZONES_MAX_WORKERS = 8
+
 def nearest_power_of_2(number):
     """Returns the nearest power of 2 that is greater than a given number"""
-    return int(pow(2, ceil(log(number, 2))))
+    if number <= 1:
+        return 1
+    return 1 << (number - 1).bit_length()
+
+def load_availability_zones(vpcs, max_workers=None):
+    """Populate the availability zones of several VPCs concurrently, as
+    each lookup is spent waiting on the EC2 API. Only one lookup is made per
+    AWS account and region, the other VPCs are filled in from the cache"""
+    pending = {}
+    for vpc in vpcs:
+        if not vpc.availability_zones:
+            pending.setdefault(vpc.availability_zones_cache_key(),
+                               []).append(vpc)
+    if not pending:
+        return
+    if max_workers is None:
+        max_workers = min(len(pending), AVAILABILITY_ZONES_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(group[0].get_availability_zones)
+                   for group in pending.values()]
+        for future in futures:
+            future.result()
+    for group in pending.values():
+        for vpc in group[1:]:
+            vpc.get_availability_zones()
 
 class VPC:
     """Helper around definiting a VPC in AWS, and define subnets based on
     an IP network given, divided equally up with assumption of public + private
     subnet for each availability zone given a AWS region"""
+    __slots__ = ('name', 'title', 'ipv4network', 'region', 'tags',
+                 'aws_profile', 'aws_credentials', '_session', '_ec2_client',
+                 'availability_zones', 'subnet_prefixlen', 'template',
+                 'network', 'outputs')
+
     def __init__(self, name, network, region, tags=None, aws_access_key=None,
                  aws_secret_key=None, aws_profile='default'):
         """Constructor"""
-        self.data = {}
-        self.data['Name'] = name
-        self.data['Title'] = TITLE_CLEANUP_RE.subn('', name)[0]
-        self.data['IPv4Network'] = ipaddress.IPv4Network(network)
-        self.data['AWS Region'] = region
+        self.name = name
+        self.title = clean_title(name)
+        self.ipv4network = ipaddress.IPv4Network(network)
+        self.region = region
 
-        self.data['Tags'] = []
+        self.tags = []
         if tags is not None:
             if isinstance(tags, dict):
                 for key, value in tags.items():
-                    self.data['Tags'].append(Tag(Key=key, Value=value))
+                    self.tags.append(Tag(Key=key, Value=value))
             elif isinstance(tags, list):
-                self.data['Tags'] = tags
-
-        self.data['AWS Credentials'] = {}
-        self.data['AWS Credentials']['Access'] = aws_access_key
-        self.data['AWS Credentials']['Secret'] = aws_secret_key
-        self.data['Session'] = None
-        self.data['Availability Zones'] = []
-        self.data['Subnet Prefixlen'] = 0
-        self.data['Template'] = Template()
+                self.tags = tags
+
+        self.aws_profile = aws_profile
+        self.aws_credentials = {}
+        self.aws_credentials['Access'] = aws_access_key
+        self.aws_credentials['Secret'] = aws_secret_key
+        self._session = None
+        self._ec2_client = None
+        self.availability_zones = []
+        self.subnet_prefixlen = 0
+        self.template = Template()
         self.network = {}
+        region_title = self.title + clean_title(region)
         self.network['VPC'] = troposphere.ec2.VPC(
-            title=self.data['Title'] + TITLE_CLEANUP_RE.subn(
-                '', region)[0] + 'VPC',
-            template=self.data['Template'],
-            CidrBlock=str(self.data['IPv4Network']),
+            title=region_title + 'VPC',
+            template=self.template,
+            CidrBlock=str(self.ipv4network),
             EnableDnsSupport=True,
             EnableDnsHostnames=True,
             InstanceTenancy='default',
-            Tags=[Tag(Key='Name', Value=name)] + self.data['Tags'])
-        self.data['Outputs'] = {}
+            Tags=self.name_tags(name))
+        self.outputs = {}
         self.add_output(
-            title=self.data['Title'] + TITLE_CLEANUP_RE.subn(
-                '', region)[0] + 'VPCID',
+            title=region_title + 'VPCID',
             description="VPC ID of {} in {}".format(name, region),
             value=Ref(self.network['VPC'].title),
-            export=Sub('${{AWS::StackName}}-{}-VPCID'.format(region)))
-        if aws_profile is not None:
-            self.data['Session'] = boto3.Session(profile_name=aws_profile,
-                                                 region_name=region)
-            creds = self.data['Session'].get_credentials()
-            self.data['AWS Credentials']['Access'] = creds.access_key
-            self.data['AWS Credentials']['Secret'] = creds.secret_key
-        elif not None in (aws_access_key, aws_secret_key):
-            self.data['Session'] = boto3.Session(
-                aws_access_key_id=aws_access_key,
-                aws_secret_access_key=aws_secret_key,
-                region_name=region)
+            export=stack_export('-' + region + '-VPCID'))
+
+    @property
+    def data(self):
+        """Returns a read-only view of the VPC settings, as previously
+        stored in the data attribute; set the attributes to change them"""
+        return MappingProxyType({
+            'Name': self.name,
+            'Title': self.title,
+            'IPv4Network': self.ipv4network,
+            'AWS Region': self.region,
+            'Tags': self.tags,
+            'AWS Profile': self.aws_profile,
+            'AWS Credentials': self.aws_credentials,
+            'Session': self._session,
+            'EC2 Client': self._ec2_client,
+            'Availability Zones': self.availability_zones,
+            'Subnet Prefixlen': self.subnet_prefixlen,
+            'Template': self.template,
+            'Outputs': self.outputs})
+
+    @property
+    def session(self):
+        """Returns the boto3 session, creating it on first use"""
+        if self._session is None:
+            if self.aws_profile is not None:
+                self._session = boto3.Session(profile_name=self.aws_profile,
+                                              region_name=self.region)
+            elif self.aws_credentials['Access'] is not None and \
+                    self.aws_credentials['Secret'] is not None:
+                self._session = boto3.Session(
+                    aws_access_key_id=self.aws_credentials['Access'],
+                    aws_secret_access_key=self.aws_credentials['Secret'],
+                    region_name=self.region)
+        return self._session
+
+    def resolve_credentials(self):
+        """Look up the access and secret key used by the session"""
+        creds = self.session.get_credentials()
+        self.aws_credentials['Access'] = creds.access_key
+        self.aws_credentials['Secret'] = creds.secret_key
+        return self.aws_credentials
+
+    def name_tags(self, name):
+        """Returns the VPC tags prefixed with a Name tag"""
+        tags = [Tag(Key='Name', Value=name)]
+        tags.extend(self.tags)
+        return tags
+
+    def get_resource(self, title):
+        """Returns a resource of the template by its title"""
+        return self.template.resources[title]
 
     def get_name(self):
         """Returns the name of the VPC"""
-        return self.data['Name']
+        return self.name
 
     def get_ipv4network(self):
         """Returns the IPv4 Network"""
-        return self.data['IPv4Network']
+        return self.ipv4network
 
     def get_region(self):
         """Returns the region"""
-        return self.data['AWS Region']
+        return self.region
 
     def add_output(self, title, description, value, export):
         """Safely add outputs to the template without duplicates"""
-        if title not in self.data['Outputs']:
-            self.data['Outputs'][title] = {}
-            self.data['Outputs'][title]['Description'] = description
-            self.data['Outputs'][title]['Value'] = value
-            self.data['Outputs'][title]['Export'] = export
-            self.data['Outputs'][title]['Output'] = Output(
-                title=title,
-                Description=description,
-                Value=value,
-                Export=Export(export))
-            self.data['Template'].add_output(
-                self.data['Outputs'][title]['Output'])
-        else:
+        output = {'Description': description,
+                  'Value': value,
+                  'Export': export,
+                  'Output': Output(title=title,
+                                   Description=description,
+                                   Value=value,
+                                   Export=Export(export))}
+        if self.outputs.setdefault(title, output) is not output:
             raise Exception('{} is already an exported resource'.format(title))
+        self.template.add_output(output['Output'])
+
+    @staticmethod
+    def invalidate_az_cache(region=None):
+        """Forget cached availability zones, either for a single region or
+        for all regions if none is given"""
+        if region is None:
+            AVAILABILITY_ZONES_CACHE.clear()
+        else:
+            for key in [key for key in AVAILABILITY_ZONES_CACHE
+                        if key[1] == region]:
+                del AVAILABILITY_ZONES_CACHE[key]
 
+    def availability_zones_cache_key(self):
+        """Returns the key of the availability zones cache for this VPC, the
+        AWS profile (or access key) and region"""
+        if self.aws_profile is not None:
+            return (self.aws_profile, self.region)
+        return (self.aws_credentials['Access'], self.region)
 
     def get_availability_zones(self):
         """Populate availability zone data"""
-        if not self.data['Availability Zones']:
-            client = self.data['Session'].client('ec2')
-            try:
-                self.data['Availability Zones'] = \
-                        [item['ZoneName']
-                         for item in client.describe_availability_zones()[
-                             'AvailabilityZones']]
-            except Exception as exception:
-                raise Exception(
-                    ('Exception occurred in the '
-                     'following region: {}').format(
-                         self.data['AWS Region'])) from exception
+        if not self.availability_zones:
+            cache_key = self.availability_zones_cache_key()
+            if cache_key not in AVAILABILITY_ZONES_CACHE:
+                if self._ec2_client is None:
+                    self._ec2_client = self.session.client('ec2')
+                try:
+                    client = self._ec2_client
+                    # Only standard zones that can be used right away,
+                    # leaving out local and wavelength zones
+                    response = client.describe_availability_zones(
+                        Filters=[{'Name': 'zone-type',
+                                  'Values': ['availability-zone']},
+                                 {'Name': 'state',
+                                  'Values': ['available']},
+                                 {'Name': 'opt-in-status',
+                                  'Values': ['opt-in-not-required',
+                                             'opted-in']}])
+                    AVAILABILITY_ZONES_CACHE[cache_key] = \
+                            [item['ZoneName']
+                             for item in response['AvailabilityZones']]
+                except Exception as exception:
+                    raise Exception(
+                        ('Exception occurred in the '
+                         'following region: {}').format(
+                             self.region)) from exception
+            self.availability_zones = list(
+                AVAILABILITY_ZONES_CACHE[cache_key])
 
     def calculate_subnet_prefixlen(self):
         """Divide up the network and calculate the prefix len for the subnets"""
-        if not self.data['Availability Zones']:
+        if not self.availability_zones:
             self.get_availability_zones()
-        num_of_zones = len(self.data['Availability Zones']) * 2
-        nearest = nearest_power_of_2(num_of_zones)
-        subnets = [next(self.data['IPv4Network'].subnets(new_prefix=item))
-                   for item in range(self.data['IPv4Network'].prefixlen + 1, 29)]
-        subnet_hosts = [item.num_addresses for item in subnets]
-        required_addresses = self.data['IPv4Network'].num_addresses / nearest
-        try:
-            subnet = subnets[subnet_hosts.index(required_addresses)]
-        except ValueError:
+        num_of_zones = len(self.availability_zones) * 2
+        # Each additional bit of prefix halves the subnet size, so the bits
+        # needed to fit every subnet is the bit length of the highest index
+        prefixlen = (self.ipv4network.prefixlen +
+                     (num_of_zones - 1).bit_length())
+        if prefixlen > 28:
             raise Exception("Provided network is too small to divide up to "
                             "use for all the availability zones in the region.")
-        self.data['Subnet Prefixlen'] = subnet.prefixlen
+        self.subnet_prefixlen = prefixlen
 
     def create_internet_gateway(self):
         """Create an internet gateway if it does not exist already"""
         if 'InternetGateway' not in self.network:
-            tag = Tag(Key='Name', Value='{} Internet Gateway'.format(
-                self.data['Name']))
             self.network['InternetGateway'] = InternetGateway(
-                title='{}InternetGateway'.format(self.data['Title']),
-                template=self.data['Template'],
-                Tags=[tag] + self.data['Tags'])
-            tag = Tag(Key='Name', Value='{} VPC Gateway Attachment'.format(
-                self.data['Name']))
+                title='{}InternetGateway'.format(self.title),
+                template=self.template,
+                Tags=self.name_tags('{} Internet Gateway'.format(
+                    self.name)))
             self.network['VPCGatewayAttachment'] = VPCGatewayAttachment(
-                title='{}VPCGatewayAttachment'.format(self.data['Title']),
-                template=self.data['Template'],
+                title='{}VPCGatewayAttachment'.format(self.title),
+                template=self.template,
                 VpcId=Ref(self.network['VPC']),
                 InternetGatewayId=Ref(self.network['InternetGateway']))
 
-    def create_public_subnet(self, zone, ip_network):
-        """Create the public subnet and associated resources"""
-        self.create_internet_gateway()
-        zone_title = self.data['Title'] + TITLE_CLEANUP_RE.subn('', zone)[0]
-        tag = Tag(Key='Name',
-                  Value='{} {} Public'.format(self.data['Name'], zone))
+    def _create_subnet(self, zone, ip_network, kind, default_route,
+                      zone_title=None, vpc_ref=None):
+        """Create a 'Public' or 'Private' subnet with its route table and
+        exports, where default_route is the (property, value) pair of the
+        route target, e.g. ('GatewayId', Ref(internet_gateway))"""
+        if kind not in ('Public', 'Private'):
+            raise Exception(("Subnet kind must be either 'Public' or "
+                             "'Private', not {}").format(kind))
+        if zone_title is None:
+            zone_title = self.title + clean_title(zone)
+        if vpc_ref is None:
+            vpc_ref = Ref(self.network['VPC'])
+        zone_name = '{} {}'.format(self.name, zone)
+        zone_description = '{} in {}'.format(self.name, zone)
+        public = kind == 'Public'
         subnet = Subnet(
-            title=zone_title + 'Public',
-            template=self.data['Template'],
+            title=zone_title + kind,
+            template=self.template,
             AvailabilityZone=zone,
             CidrBlock=ip_network,
-            MapPublicIpOnLaunch=True,
-            Tags=[tag] + self.data['Tags'],
-            VpcId=Ref(self.network['VPC']))
-        eip = EIP(
-            title=zone_title + 'NatEIP',
-            template=self.data['Template'],
-            Domain='vpc',
-            DependsOn=self.network['VPCGatewayAttachment'].title)
-        tag = Tag(Key='Name',
-                  Value='{} {} NAT Gateway'.format(
-                      self.data['Name'], zone))
-        natgateway = NatGateway(
-            title=zone_title + 'NATGateway',
-            template=self.data['Template'],
-            AllocationId=GetAtt(zone_title + 'NatEIP', 'AllocationId'),
-            SubnetId=Ref(subnet),
-            DependsOn=eip.title,
-            Tags=[tag] + self.data['Tags'])
-        tag = Tag(Key='Name',
-                  Value='{} {} Public Route Table'.format(
-                      self.data['Name'], zone))
+            MapPublicIpOnLaunch=public,
+            Tags=self.name_tags(zone_name + ' ' + kind),
+            VpcId=vpc_ref)
+        subnet_ref = Ref(subnet)
+        if public:
+            eip = EIP(
+                title=zone_title + 'NatEIP',
+                template=self.template,
+                Domain='vpc',
+                DependsOn=self.network['VPCGatewayAttachment'].title)
+            natgateway = NatGateway(
+                title=zone_title + 'NATGateway',
+                template=self.template,
+                AllocationId=GetAtt(zone_title + 'NatEIP', 'AllocationId'),
+                SubnetId=subnet_ref,
+                DependsOn=eip.title,
+                Tags=self.name_tags(zone_name + ' NAT Gateway'))
+            # Every resource is registered with the template, only keep what
+            # the private subnet needs; see get_resource for the rest
+            self.network['Subnets'][zone]['Public'] = {
+                'NatGateway': natgateway}
         routetable = RouteTable(
-            title=zone_title + 'PublicRouteTable',
-            template=self.data['Template'],
-            VpcId=Ref(self.network['VPC']),
-            Tags=[tag] + self.data['Tags'])
-        route = Route(
-            title=zone_title + 'PublicDefaultRoute',
-            template=self.data['Template'],
+            title=zone_title + kind + 'RouteTable',
+            template=self.template,
+            VpcId=vpc_ref,
+            Tags=self.name_tags(zone_name + ' ' + kind + ' Route Table'))
+        routetable_ref = Ref(routetable)
+        route_property, route_target = default_route
+        Route(
+            title=zone_title + kind + 'DefaultRoute',
+            template=self.template,
             DestinationCidrBlock='0.0.0.0/0',
-            GatewayId=Ref(self.network['InternetGateway']),
-            RouteTableId=Ref(routetable))
-        subnetroutetableassociation = SubnetRouteTableAssociation(
-            title=zone_title + 'PublicSubnetRouteTableAssociation',
-            template=self.data['Template'],
-            RouteTableId=Ref(routetable),
-            SubnetId=Ref(subnet))
-
-        self.network['Subnets'][zone]['Public'] = {}
-        self.network['Subnets'][zone]['Public']['Subnet'] = subnet
-        self.network['Subnets'][zone]['Public']['EIP'] = eip
-        self.network['Subnets'][zone]['Public']['NatGateway'] = natgateway
-        self.network['Subnets'][zone]['Public']['RouteTable'] = routetable
-        self.network['Subnets'][zone]['Public']['DefaultRoute'] = route
-        self.network['Subnets'][zone]['Public'][
-            'SubnetRouteTableAssociation'] = subnetroutetableassociation
-
-        # Export Public Subnet ID
+            RouteTableId=routetable_ref,
+            **{route_property: route_target})
+        SubnetRouteTableAssociation(
+            title=zone_title + kind + 'SubnetRouteTableAssociation',
+            template=self.template,
+            RouteTableId=routetable_ref,
+            SubnetId=subnet_ref)
+
+        # Private exports have never had separators around the zone, keep
+        # them as they are so existing imports still resolve
+        if public:
+            export_prefix = '-' + zone + '-' + kind
+        else:
+            export_prefix = zone + kind
+        # Export Subnet ID
         self.add_output(
-            title=self.data['Title'] + zone_title + 'PublicSubnet',
-            description="Public Subnet ID of {} in {}".format(
-                self.data['Name'], zone),
-            value=Ref(subnet),
-            export=Sub('${{AWS::StackName}}-{}-PublicSubnet'.format(
-                zone)))
-        # Export Public Route Table ID
+            title=self.title + zone_title + kind + 'Subnet',
+            description=kind + " Subnet ID of " + zone_description,
+            value=subnet_ref,
+            export=stack_export(export_prefix + 'Subnet'))
+        # Export Route Table ID
         self.add_output(
-            title=self.data['Title'] + zone_title + 'PublicRouteTable',
-            description="Public Route Table ID of {} in {}".format(
-                self.data['Name'], zone),
-            value=Ref(routetable),
-            export=Sub('${{AWS::StackName}}-{}-PublicRouteTable'.format(
-                zone)))
-
-    def create_private_subnet(self, zone, ip_network):
+            title=self.title + zone_title + kind + 'RouteTable',
+            description=kind + " Route Table ID of " + zone_description,
+            value=routetable_ref,
+            export=stack_export(export_prefix + 'RouteTable'))
+
+    def create_public_subnet(self, zone, ip_network, zone_title=None,
+                             vpc_ref=None, igw_ref=None):
+        """Create the public subnet and associated resources"""
+        self.create_internet_gateway()
+        if igw_ref is None:
+            igw_ref = Ref(self.network['InternetGateway'])
+        self._create_subnet(zone, ip_network, 'Public',
+                            ('GatewayId', igw_ref), zone_title, vpc_ref)
+
+    def create_private_subnet(self, zone, ip_network, zone_title=None,
+                              vpc_ref=None):
         """Create private subnet and associated resources"""
         if not 'Public' in self.network['Subnets'][zone]:
             raise Exception(("Public subnet in {} does not exist to "
@@ -245,74 +386,44 @@ class VPC:
             raise Exception(("No NAT Gateway in public subnet {} to associate "
                              "default route with in private subnet!").format(
                                  zone))
-        zone_title = self.data['Title'] + TITLE_CLEANUP_RE.subn('', zone)[0]
-        tag = Tag(Key='Name',
-                  Value='{} {} Private'.format(self.data['Name'], zone))
-        subnet = Subnet(
-            title=zone_title + 'Private',
-            template=self.data['Template'],
-            AvailabilityZone=zone,
-            CidrBlock=ip_network,
-            MapPublicIpOnLaunch=False,
-            Tags=[tag] + self.data['Tags'],
-            VpcId=Ref(self.network['VPC']))
-        tag = Tag(Key='Name',
-                  Value='{} {} Private Route Table'.format(
-                      self.data['Name'], zone))
-        routetable = RouteTable(
-            title=zone_title + 'PrivateRouteTable',
-            template=self.data['Template'],
-            VpcId=Ref(self.network['VPC']),
-            Tags=[tag] + self.data['Tags'])
         nat_gateway_id = Ref(self.network['Subnets'][zone]['Public'][
             'NatGateway'])
-        route = Route(
-            title=zone_title + 'PrivateDefaultRoute',
-            template=self.data['Template'],
-            DestinationCidrBlock='0.0.0.0/0',
-            NatGatewayId=nat_gateway_id,
-            RouteTableId=Ref(routetable))
-        subnetroutetableassociation = SubnetRouteTableAssociation(
-            title=zone_title + 'PrivateSubnetRouteTableAssociation',
-            template=self.data['Template'],
-            RouteTableId=Ref(routetable),
-            SubnetId=Ref(subnet))
-        self.network['Subnets'][zone]['Private'] = {}
-        self.network['Subnets'][zone]['Private']['Subnet'] = subnet
-        self.network['Subnets'][zone]['Private']['RouteTable'] = routetable
-        self.network['Subnets'][zone]['Private']['DefaultRoute'] = route
-        self.network['Subnets'][zone]['Private'][
-            'SubnetRouteTableAssociation'] = subnetroutetableassociation
-
-        # Export Private Subnet ID
-        self.add_output(
-            title=self.data['Title'] + zone_title + 'PrivateSubnet',
-            description="Private Subnet ID of {} in {}".format(
-                self.data['Name'], zone),
-            value=Ref(subnet),
-            export=Sub('${{AWS::StackName}}{}PrivateSubnet'.format(
-                zone)))
-        # Export Private Route Table ID
-        self.add_output(
-            title=self.data['Title'] + zone_title + 'PrivateRouteTable',
-            description="Private Route Table ID of {} in {}".format(
-                self.data['Name'], zone),
-            value=Ref(routetable),
-            export=Sub('${{AWS::StackName}}{}PrivateRouteTable'.format(
-                zone)))
+        self._create_subnet(zone, ip_network, 'Private',
+                            ('NatGatewayId', nat_gateway_id), zone_title,
+                            vpc_ref)
 
     def create_subnets(self):
         """Create all the public and private subnets"""
         self.get_availability_zones()
-        if self.data['Subnet Prefixlen'] == 0:
+        if self.subnet_prefixlen == 0:
             self.calculate_subnet_prefixlen()
         self.network['Subnets'] = {}
-        subnets = self.data['IPv4Network'].subnets(new_prefix=self.data[
-            'Subnet Prefixlen'])
-        for zone in self.data['Availability Zones']:
+        # Subnets are laid out back to back from the start of the network,
+        # public then private for each zone
+        prefixlen = self.subnet_prefixlen
+        address = int(self.ipv4network.network_address)
+        step = 1 << (32 - prefixlen)
+        if prefixlen < self.ipv4network.prefixlen or \
+                2 * len(self.availability_zones) * step > \
+                self.ipv4network.num_addresses:
+            raise Exception("Provided network is too small to divide up to "
+                            "use for all the availability zones in the region.")
+        ipv4address = ipaddress.IPv4Address
+        self.create_internet_gateway()
+        vpc_ref = Ref(self.network['VPC'])
+        igw_ref = Ref(self.network['InternetGateway'])
+        for zone in self.availability_zones:
             self.network['Subnets'][zone] = {}
-            self.create_public_subnet(zone, str(next(subnets)))
-            self.create_private_subnet(zone, str(next(subnets)))
+            zone_title = self.title + clean_title(zone)
+            public_network = '{}/{}'.format(
+                ipv4address(address), prefixlen)
+            private_network = '{}/{}'.format(
+                ipv4address(address + step), prefixlen)
+            self.create_public_subnet(zone, public_network, zone_title,
+                                      vpc_ref, igw_ref)
+            self.create_private_subnet(zone, private_network, zone_title,
+                                       vpc_ref)
+            address += 2 * step
 
     def write_template(self, filename, file_format='yaml'):
         """Write the template to a file"""
@@ -323,9 +434,9 @@ class VPC:
         # Write the file
         with open(filename, 'w') as file_out:
             if file_format in ('yml', 'yaml'):
-                file_out.write(self.data['Template'].to_yaml())
+                file_out.write(self.template.to_yaml())
             elif file_format in ('jsn', 'json'):
-                file_out.write(self.data['Template'].to_json())
+                file_out.write(self.template.to_json())
             else:
                 raise Exception(("write_template(filename={}, file_format={}):"
                                  " file_format must be either 'json' or 'yaml'".format(